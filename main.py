@@ -1,28 +1,53 @@
-from fastapi import FastAPI, HTTPException, status, Depends
-from pydantic import BaseModel
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, status, Depends, Request, Response
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict
 from typing import List, Optional
-from sqlalchemy import create_engine, Column, String, ForeignKey
-from sqlalchemy.orm import declarative_base, relationship, sessionmaker, Session, joinedload
-import uuid
+from sqlalchemy import Column, Index, Integer, String, ForeignKey, select, insert, update, delete, bindparam, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import declarative_base, relationship, selectinload, raiseload
+from uuid_extensions import uuid7
+import orjson
 import random
 
 # Database setup
-SQLALCHEMY_DATABASE_URL = "postgresql://santa:secret@db:5432/santadb"
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SQLALCHEMY_DATABASE_URL = "postgresql+asyncpg://santa:secret@db:5432/santadb"
+engine = create_async_engine(
+    SQLALCHEMY_DATABASE_URL,
+    pool_size=20,
+    max_overflow=10,
+    pool_timeout=30,
+    pool_pre_ping=True,
+    pool_recycle=1800
+)
+SessionLocal = async_sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 Base = declarative_base()
 
+# create_all skips tables that already exist, so later column and index changes are applied here
+SCHEMA_UPGRADES = [
+    "ALTER TABLE groups ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_participants_group_id_id ON participants (group_id, id)",
+    "DROP INDEX IF EXISTS ix_participants_id",
+    "DROP INDEX IF EXISTS ix_groups_id",
+]
+
 # Database models
 class GroupDB(Base):
     __tablename__ = "groups"
-    id = Column(String, primary_key=True, index=True)
+    id = Column(String, primary_key=True)
     name = Column(String)
     description = Column(String, nullable=True)
+    version = Column(Integer, nullable=False, default=0, server_default="0")
     participants = relationship("ParticipantDB", back_populates="group")
 
 class ParticipantDB(Base):
     __tablename__ = "participants"
-    id = Column(String, primary_key=True, index=True)
+    __table_args__ = (
+        Index("ix_participants_group_id_id", "group_id", "id", unique=True),
+    )
+    id = Column(String, primary_key=True)
     name = Column(String)
     wish = Column(String, nullable=True)
     group_id = Column(String, ForeignKey("groups.id"))
@@ -31,7 +56,16 @@ class ParticipantDB(Base):
     group = relationship("GroupDB", back_populates="participants")
     recipient = relationship("ParticipantDB", remote_side=[id])
 
-Base.metadata.create_all(bind=engine)
+# Recipient lookup as a plain Core query: one JOIN, three columns, no ORM objects
+recipient_table = ParticipantDB.__table__.alias("recipient")
+recipient_query = select(recipient_table.c.id, recipient_table.c.name, recipient_table.c.wish)\
+    .select_from(ParticipantDB.__table__.join(
+        recipient_table, ParticipantDB.recipient_id == recipient_table.c.id
+    ))\
+    .where(
+        ParticipantDB.id == bindparam("participant_id"),
+        ParticipantDB.group_id == bindparam("group_id")
+    )
 
 # Pydantic models
 class ParticipantBase(BaseModel):
@@ -46,14 +80,12 @@ class ParticipantLite(BaseModel):
     name: str
     wish: Optional[str] = None
     
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class Participant(ParticipantLite):
     recipient: Optional[ParticipantLite] = None
     
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class GroupBase(BaseModel):
     name: str
@@ -62,22 +94,53 @@ class GroupBase(BaseModel):
 class GroupCreate(GroupBase):
     pass
 
+class GroupSummary(GroupBase):
+    id: str
+
 class Group(GroupBase):
     id: str
     participants: List[Participant] = []
     
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 # Dependency
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        for statement in SCHEMA_UPGRADES:
+            await conn.execute(text(statement))
+    yield
+    await engine.dispose()
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+
+rng = random.Random()
+
+def sattolo(items: list) -> None:
+    # Shuffle in place into a single random cycle, so no element stays put
+    randrange = rng.randrange
+    for i in range(len(items) - 1, 0, -1):
+        j = randrange(i)
+        items[i], items[j] = items[j], items[i]
+
+def bump_group_version(group_id: str):
+    return update(GroupDB)\
+        .where(GroupDB.id == group_id)\
+        .values(version=GroupDB.version + 1)
+
+# Rendered get_group bodies keyed by (group_id, version); writes bump the version
+GROUP_CACHE_SIZE = 1024
+group_cache: "OrderedDict[tuple, bytes]" = OrderedDict()
+
+def cache_group(key: tuple, body: bytes) -> None:
+    group_cache[key] = body
+    if len(group_cache) > GROUP_CACHE_SIZE:
+        group_cache.popitem(last=False)
 
 def serialize_participant(participant: ParticipantDB) -> dict:
     return {
@@ -92,95 +155,135 @@ def serialize_participant(participant: ParticipantDB) -> dict:
     }
 
 @app.post("/group", status_code=status.HTTP_201_CREATED)
-def create_group(group_data: GroupCreate, db: Session = Depends(get_db)):
-    group_id = str(uuid.uuid4())
-    db_group = GroupDB(id=group_id, **group_data.dict())
+async def create_group(group_data: GroupCreate, db: AsyncSession = Depends(get_db)):
+    group_id = uuid7().hex
+    db_group = GroupDB(id=group_id, **group_data.model_dump())
     db.add(db_group)
-    db.commit()
+    await db.commit()
     return {"id": group_id}
 
-@app.get("/groups", response_model=List[Group])
-def get_groups(db: Session = Depends(get_db)):
-    groups = db.query(GroupDB).all()
-    return [{
+@app.get("/groups", responses={200: {"model": List[GroupSummary]}})
+async def get_groups(db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(GroupDB.id, GroupDB.name, GroupDB.description))
+    return ORJSONResponse([{
         "id": group.id,
         "name": group.name,
-        "description": group.description,
-        "participants": []
-    } for group in groups]
+        "description": group.description
+    } for group in result])
 
-@app.get("/group/{group_id}", response_model=Group)
-def get_group(group_id: str, db: Session = Depends(get_db)):
-    group = db.query(GroupDB)\
-        .options(joinedload(GroupDB.participants).joinedload(ParticipantDB.recipient))\
-        .filter(GroupDB.id == group_id)\
-        .first()
+@app.get("/group/{group_id}", responses={200: {"model": Group}})
+async def get_group(group_id: str, request: Request, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(GroupDB.version).where(GroupDB.id == group_id))
+    version = result.scalar_one_or_none()
     
-    if not group:
+    if version is None:
         raise HTTPException(status_code=404, detail="Group not found")
     
-    return {
-        "id": group.id,
-        "name": group.name,
-        "description": group.description,
-        "participants": [serialize_participant(p) for p in group.participants]
-    }
+    etag = f'"{group_id}-{version}"'
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    
+    body = group_cache.get((group_id, version))
+    if body is not None:
+        group_cache.move_to_end((group_id, version))
+    else:
+        result = await db.execute(
+            select(GroupDB)
+            .options(
+                selectinload(GroupDB.participants).joinedload(ParticipantDB.recipient),
+                raiseload("*")
+            )
+            .where(GroupDB.id == group_id)
+        )
+        group = result.scalar_one_or_none()
+        
+        if not group:
+            raise HTTPException(status_code=404, detail="Group not found")
+        
+        version = group.version
+        etag = f'"{group_id}-{version}"'
+        body = orjson.dumps({
+            "id": group.id,
+            "name": group.name,
+            "description": group.description,
+            "participants": [serialize_participant(p) for p in group.participants]
+        })
+        cache_group((group_id, version), body)
+    
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
 
 @app.put("/group/{group_id}")
-def update_group(group_id: str, group_data: GroupCreate, db: Session = Depends(get_db)):
-    group = db.query(GroupDB).filter(GroupDB.id == group_id).first()
+async def update_group(group_id: str, group_data: GroupCreate, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(GroupDB).where(GroupDB.id == group_id))
+    group = result.scalar_one_or_none()
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
     
     group.name = group_data.name
     group.description = group_data.description
-    db.commit()
+    await db.execute(bump_group_version(group_id))
+    await db.commit()
     return {"message": "Group updated"}
 
 @app.delete("/group/{group_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_group(group_id: str, db: Session = Depends(get_db)):
-    group = db.query(GroupDB).filter(GroupDB.id == group_id).first()
-    if not group:
+async def delete_group(group_id: str, db: AsyncSession = Depends(get_db)):
+    await db.execute(
+        update(ParticipantDB)
+        .where(ParticipantDB.group_id == group_id)
+        .values(group_id=None)
+    )
+    result = await db.execute(delete(GroupDB).where(GroupDB.id == group_id).returning(GroupDB.id))
+    if result.scalar_one_or_none() is None:
         raise HTTPException(status_code=404, detail="Group not found")
     
-    db.delete(group)
-    db.commit()
+    await db.commit()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 @app.post("/group/{group_id}/participant", status_code=status.HTTP_201_CREATED)
-def add_participant(group_id: str, participant_data: ParticipantCreate, db: Session = Depends(get_db)):
-    group = db.query(GroupDB).filter(GroupDB.id == group_id).first()
-    if not group:
+async def add_participant(group_id: str, participant_data: ParticipantCreate, db: AsyncSession = Depends(get_db)):
+    participant_id = uuid7().hex
+    try:
+        # The group_id foreign key doubles as the group existence check
+        await db.execute(insert(ParticipantDB).values(
+            id=participant_id,
+            **participant_data.model_dump(),
+            group_id=group_id
+        ))
+    except IntegrityError:
+        await db.rollback()
         raise HTTPException(status_code=404, detail="Group not found")
     
-    participant_id = str(uuid.uuid4())
-    db_participant = ParticipantDB(
-        id=participant_id,
-        **participant_data.dict(),
-        group_id=group_id
-    )
-    db.add(db_participant)
-    db.commit()
+    await db.execute(bump_group_version(group_id))
+    await db.commit()
     return {"id": participant_id}
 
 @app.delete("/group/{group_id}/participant/{participant_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_participant(group_id: str, participant_id: str, db: Session = Depends(get_db)):
-    participant = db.query(ParticipantDB).filter(
-        ParticipantDB.id == participant_id,
-        ParticipantDB.group_id == group_id
-    ).first()
+async def delete_participant(group_id: str, participant_id: str, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(
+        delete(ParticipantDB)
+        .where(
+            ParticipantDB.id == participant_id,
+            ParticipantDB.group_id == group_id
+        )
+        .returning(ParticipantDB.id)
+    )
     
-    if not participant:
+    if result.scalar_one_or_none() is None:
         raise HTTPException(status_code=404, detail="Participant not found")
     
-    db.delete(participant)
-    db.commit()
+    await db.execute(bump_group_version(group_id))
+    await db.commit()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
 
-@app.post("/group/{group_id}/toss", response_model=List[Participant])
-def toss(group_id: str, db: Session = Depends(get_db)):
-    group = db.query(GroupDB)\
-        .options(joinedload(GroupDB.participants))\
-        .filter(GroupDB.id == group_id)\
-        .first()
+@app.post("/group/{group_id}/toss", responses={200: {"model": List[Participant]}})
+async def toss(group_id: str, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(
+        select(GroupDB)
+        .options(selectinload(GroupDB.participants), raiseload("*"))
+        .where(GroupDB.id == group_id)
+    )
+    group = result.scalar_one_or_none()
     
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
@@ -190,36 +293,44 @@ def toss(group_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=409, detail="Not enough participants")
     
     participant_ids = [p.id for p in participants]
+    # Plain snapshot of the loaded rows; nothing below touches the ORM objects
+    by_id = {p.id: {"id": p.id, "name": p.name, "wish": p.wish} for p in participants}
     
     # Generate valid permutation
-    while True:
-        shuffled_ids = random.sample(participant_ids, len(participant_ids))
-        if all(a != b for a, b in zip(participant_ids, shuffled_ids)):
-            break
+    shuffled_ids = participant_ids[:]
+    sattolo(shuffled_ids)
     
-    # Update recipients
-    for participant, recipient_id in zip(participants, shuffled_ids):
-        participant.recipient_id = recipient_id
+    # Update recipients in a single executemany
+    await db.execute(update(ParticipantDB), [
+        {"id": participant_id, "recipient_id": recipient_id}
+        for participant_id, recipient_id in zip(participant_ids, shuffled_ids)
+    ])
     
-    db.commit()
+    response = [
+        {**by_id[participant_id], "recipient": by_id[recipient_id]}
+        for participant_id, recipient_id in zip(participant_ids, shuffled_ids)
+    ]
     
-    # Return serialized participants
-    return [serialize_participant(p) for p in participants]
+    await db.execute(bump_group_version(group_id))
+    await db.commit()
+    return ORJSONResponse(response)
 
-@app.get("/group/{group_id}/participant/{participant_id}/recipient", response_model=ParticipantLite)
-def get_recipient(group_id: str, participant_id: str, db: Session = Depends(get_db)):
-    participant = db.query(ParticipantDB)\
-        .options(joinedload(ParticipantDB.recipient))\
-        .filter(
-            ParticipantDB.id == participant_id,
-            ParticipantDB.group_id == group_id
-        )\
-        .first()
+@app.get("/group/{group_id}/participant/{participant_id}/recipient", responses={200: {"model": ParticipantLite}})
+async def get_recipient(group_id: str, participant_id: str, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(recipient_query, {
+        "participant_id": participant_id,
+        "group_id": group_id
+    })
+    recipient = result.first()
     
-    if not participant or not participant.recipient:
+    if not recipient:
         raise HTTPException(status_code=404, detail="Recipient not found")
     
-    return participant.recipient
+    return ORJSONResponse({
+        "id": recipient.id,
+        "name": recipient.name,
+        "wish": recipient.wish
+    })
 
 if __name__ == "__main__":
     import uvicorn